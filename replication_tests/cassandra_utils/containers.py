@@ -0,0 +1,108 @@
+"""
+Map host ports to the Podman containers exposing them, cached for the whole run.
+"""
+import subprocess
+import threading
+from typing import Dict, Optional
+
+try:
+    from orjson import loads as json_loads
+except ImportError:  # orjson is optional; the stdlib parser also accepts bytes
+    from json import loads as json_loads
+
+# Host TCP port -> container ID, filled by a single `podman ps` on first lookup
+_PORT_TO_ID: Optional[Dict[int, str]] = None
+_LOCK = threading.Lock()
+
+
+def _load_port_map() -> Dict[int, str]:
+    """
+    Query Podman once and map every published TCP host port to its container ID.
+
+    Containers are streamed one JSON object per line and parsed as they arrive,
+    rather than buffering and decoding one large JSON array.
+    """
+    port_map: Dict[int, str] = {}
+    with subprocess.Popen(
+        ["podman", "ps", "--format", "{{json .}}"],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+    ) as proc:
+        for line in proc.stdout:
+            if not line.strip():
+                continue
+            cont = json_loads(line)
+            for p in cont.get("Ports") or []:
+                if p.get("protocol") == "tcp" and p.get("host_port"):
+                    port_map[p["host_port"]] = cont.get("Id")
+    if proc.returncode != 0:
+        return {}  # Podman not available or error
+    return port_map
+
+
+def get_container_id_for_port(port: int) -> Optional[str]:
+    """
+    Return the Podman container ID exposing the given host port, or None if not found.
+    """
+    global _PORT_TO_ID
+    with _LOCK:
+        if _PORT_TO_ID is None:
+            _PORT_TO_ID = _load_port_map()
+        return _PORT_TO_ID.get(port)
+
+
+def invalidate() -> None:
+    """
+    Drop the cached port map, e.g. after containers were recreated.
+    """
+    global _PORT_TO_ID
+    with _LOCK:
+        _PORT_TO_ID = None
+
+
+class ContainerShell:
+    """
+    A long-lived ``sh`` inside a container, so several commands share one ``podman exec``.
+    """
+    _SENTINEL = "__CMD_DONE__"
+
+    def __init__(self, container_id: str) -> None:
+        # Not a `with` block: the shell outlives __init__ and is ended by close()
+        self._proc = subprocess.Popen(  # pylint: disable=consider-using-with
+            ["podman", "exec", "-i", container_id, "sh"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            text=True,
+        )
+
+    def run(self, command: str) -> None:
+        """
+        Run ``command`` in the shell and wait for it to finish.
+
+        :raises subprocess.CalledProcessError: If the command exits non-zero
+            or the shell goes away.
+        """
+        try:
+            self._proc.stdin.write(f"{command}; echo {self._SENTINEL} $?\n")
+            self._proc.stdin.flush()
+        except OSError as exc:
+            # BrokenPipeError and friends: `podman exec` has already exited
+            raise subprocess.CalledProcessError(self._proc.wait() or 1, command) from exc
+        output = []
+        for line in self._proc.stdout:
+            if line.startswith(self._SENTINEL):
+                status = int(line.split()[1])
+                break
+            output.append(line)
+        else:
+            status = self._proc.wait() or 1
+        if status:
+            raise subprocess.CalledProcessError(status, command, "".join(output))
+
+    def close(self) -> None:
+        """
+        End the shell and wait for ``podman exec`` to exit.
+        """
+        try:
+            self._proc.stdin.close()
+        except OSError:
+            pass  # Unsent input to a shell that already exited
+        self._proc.wait(timeout=5)
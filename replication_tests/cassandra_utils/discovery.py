@@ -2,16 +2,31 @@
 Discover Cassandra nodes via environment variable or Podman, with fallback to localhost.
 """
 import os
-import json
+import re
 import subprocess
+from functools import lru_cache
 from typing import List, Tuple
 
+# Matches the host side of the CQL port mapping, e.g. "0.0.0.0:9043->9042/tcp"
+_PORT_RE = re.compile(r"(?:\S*:)?(\d+)->9042/tcp")
 
+
+def _parse_node_spec(spec: str) -> Tuple[str, int]:
+    """
+    Parse a ``host:port`` spec, defaulting to localhost and port 9042.
+    """
+    host, _, port = spec.partition(":")
+    return host or "localhost", int(port or 9042)
+
+
+@lru_cache(maxsize=1)
 def discover_nodes(env_var: str = "CASSANDRA_NODES", fallback_n: int = 4) -> List[Tuple[str, int]]:
     """
     Return a list of (host, port) tuples for Cassandra contact points.
 
     First tries an environment variable override, then Podman containers, then falls back.
+    The result is memoized, so Podman is only queried once per process; callers must
+    not mutate the returned list.
 
     :param env_var: Name of the env var containing comma-separated host:port specs.
     :param fallback_n: Number of sequential localhost ports to use if no containers found.
@@ -21,40 +36,25 @@ def discover_nodes(env_var: str = "CASSANDRA_NODES", fallback_n: int = 4) -> Lis
     if override:
         print(f"[DISCOVERY] Using ${{{env_var}}} override → {override}")
         # Parse comma-separated host:port entries
-        return [
-            (spec.partition(":")[0] or "localhost", int(spec.partition(":")[2] or 9042))
-            for spec in override.split(",")
-        ]
+        return [_parse_node_spec(spec) for spec in override.split(",")]
 
     try:
-        # Query Podman for running containers in JSON
+        # Ask Podman for just the port mappings of Cassandra containers
         podman_output = subprocess.check_output(
-            ["podman", "ps", "--format", "json"], text=True, stderr=subprocess.DEVNULL
+            ["podman", "ps", "--filter", "name=cassandra", "--format", "{{.Ports}}"],
+            text=True, stderr=subprocess.DEVNULL,
         )
-        containers = json.loads(podman_output)
     except subprocess.CalledProcessError:
-        containers = []  # Podman not available or error
+        podman_output = ""  # Podman not available or error
 
     nodes: List[Tuple[str, int]] = []
-    for container in containers:
-        # Get container name(s)
-        names = container.get("Names") or container.get("Name") or ""
-        cname = " ".join(names) if isinstance(names, list) else str(names)
-        if "cassandra" not in cname.lower():
-            continue
-        # Inspect ports for Cassandra default port
-        for port_info in container.get("Ports", []):
-            if (
-                port_info.get("container_port") == 9042
-                and port_info.get("protocol") == "tcp"
-            ):
-                host_port = port_info.get("host_port", 0)
-                if host_port:
-                    nodes.append(("localhost", host_port))
-                    break
+    for line in podman_output.splitlines():
+        match = _PORT_RE.search(line)
+        if match:
+            nodes.append(("localhost", int(match.group(1))))
 
     if nodes:
-        print(f"[DISCOVERY] Found {len(nodes)} node(s) via Podman ps json")
+        print(f"[DISCOVERY] Found {len(nodes)} node(s) via Podman ps")
         return nodes
 
     # Fallback to sequential localhost ports
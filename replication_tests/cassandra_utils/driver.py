@@ -1,28 +1,216 @@
 """
 Session factory for connecting to a Cassandra cluster using a white-list policy.
 """
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Dict, List, Set, Tuple
+
 from cassandra.cluster import Cluster, ExecutionProfile, EXEC_PROFILE_DEFAULT
 from cassandra.policies import WhiteListRoundRobinPolicy
 from cassandra import ConsistencyLevel
 from cassandra.cluster import Session
+from cassandra.query import PreparedStatement, SimpleStatement, Statement
+
+try:
+    # Compiled libev event loop; only available when libev was present at install time
+    from cassandra.io.libevreactor import LibevConnection
+except ImportError:
+    LibevConnection = None
+
+
+# Options shared by every Cluster: pin protocol v5 (Cassandra 4.0+) so no version
+# downgrade handshake is needed, and use the libev reactor when it is installed
+_CLUSTER_DEFAULTS: Dict[str, Any] = {"protocol_version": 5}
+if LibevConnection is not None:
+    _CLUSTER_DEFAULTS["connection_class"] = LibevConnection
+
+# A session paired with the execution profile that pins requests to one node
+PinnedSession = Tuple[Session, Any]
 
+# Prepared statements, keyed by (cluster, keyspace, CQL string); evicted on shutdown
+_PREPARED: Dict[Tuple[Cluster, Any, str], PreparedStatement] = {}
 
-def make_session(host: str, port: int) -> Session:
+# (cluster, keyspace) pairs whose schema has been created; evicted on shutdown
+_ENSURED: Set[Tuple[Cluster, str]] = set()
+_ENSURED_LOCK = threading.Lock()
+
+
+def _pinned_profile(host: str) -> ExecutionProfile:
+    """
+    Build an execution profile whose requests are only routed to ``host``.
+    """
+    return ExecutionProfile(
+        consistency_level=ConsistencyLevel.ONE,
+        load_balancing_policy=WhiteListRoundRobinPolicy([host]),
+    )
+
+
+def node_label(host: str, port: int) -> str:
+    """
+    Return the ``host:port`` label used to name a node's execution profile.
+    """
+    return f"{host}:{port}"
+
+
+def make_session(host: str, port: int, **cluster_options: Any) -> Session:
     """
     Create and return a Cassandra session with a white-list round-robin policy.
 
     :param host: Hostname or IP of the contact point.
     :param port: Thrift/native transport port of the cluster.
+    :param cluster_options: Extra keyword arguments for the ``Cluster``.
     :return: Connected Cassandra Session.
     """
-    # Define consistency and load balancing
-    profile = ExecutionProfile(
-        consistency_level=ConsistencyLevel.ONE,
-        load_balancing_policy=WhiteListRoundRobinPolicy([host]),
-    )
     # Build cluster and connect
     cluster = Cluster(
         contact_points=[host], port=port,
-        execution_profiles={EXEC_PROFILE_DEFAULT: profile},
+        execution_profiles={EXEC_PROFILE_DEFAULT: _pinned_profile(host)},
+        **{**_CLUSTER_DEFAULTS, **cluster_options},
+    )
+    return cluster.connect()
+
+
+def make_shared_session(nodes: List[Tuple[str, int]]) -> Session:
+    """
+    Create a single session over all nodes, with one execution profile per node.
+
+    Each profile is named by :func:`node_label` and pins requests to that node;
+    the default profile pins to the first node.
+
+    :param nodes: List of (host, port) contact points sharing the same port.
+    :return: Connected Cassandra Session.
+    """
+    # One profile per distinct host, shared by every name that pins to it
+    by_host = {h: _pinned_profile(h) for h, _ in nodes}
+    profiles = {node_label(h, p): by_host[h] for h, p in nodes}
+    profiles[EXEC_PROFILE_DEFAULT] = by_host[nodes[0][0]]
+    cluster = Cluster(
+        contact_points=[h for h, _ in nodes], port=nodes[0][1],
+        execution_profiles=profiles,
+        **_CLUSTER_DEFAULTS,
     )
     return cluster.connect()
+
+
+def prepare(session: Session, cql: str) -> PreparedStatement:
+    """
+    Return the prepared statement for ``cql``, preparing it once per Cluster and keyspace.
+
+    :param session: Session used to prepare the statement on a cache miss.
+    :param cql: CQL string to prepare.
+    :return: Cached PreparedStatement.
+    """
+    key = (session.cluster, session.keyspace, cql)
+    statement = _PREPARED.get(key)
+    if statement is None:
+        statement = _PREPARED.setdefault(key, session.prepare(cql))
+    return statement
+
+
+def ensure_schema(
+    session: Session, keyspace: str, statements: List[Statement], **execute_options: Any
+) -> None:
+    """
+    Run the DDL ``statements`` for ``keyspace`` once per Cluster.
+
+    Each DDL statement waits for schema agreement across the cluster, so
+    repeated runs over the same Cluster skip them entirely.
+
+    :param session: Session to run the statements on.
+    :param keyspace: Keyspace the statements create; used as the cache key.
+    :param statements: DDL statements, executed in order.
+    :param execute_options: Extra keyword arguments for ``session.execute``.
+    """
+    key = (session.cluster, keyspace)
+    with _ENSURED_LOCK:
+        if key in _ENSURED:
+            return
+    for statement in statements:
+        session.execute(statement, **execute_options)
+    with _ENSURED_LOCK:
+        _ENSURED.add(key)
+
+
+@lru_cache(maxsize=None)
+def create_keyspace_statement(keyspace: str, replication_factor: int) -> SimpleStatement:
+    """
+    Return an idempotent ``CREATE KEYSPACE IF NOT EXISTS`` statement, built once per arguments.
+
+    :param keyspace: Name of the keyspace to create.
+    :param replication_factor: SimpleStrategy replication factor.
+    :return: Cached SimpleStatement.
+    """
+    return SimpleStatement(
+        f"CREATE KEYSPACE IF NOT EXISTS {keyspace} WITH replication = "
+        f"{{'class':'SimpleStrategy','replication_factor':{replication_factor}}}",
+        is_idempotent=True,
+    )
+
+
+def make_sessions(nodes: List[Tuple[str, int]]) -> List[Session]:
+    """
+    Open one session per node concurrently so the connection handshakes overlap.
+
+    :param nodes: List of (host, port) contact points.
+    :return: Connected sessions, in the same order as ``nodes``.
+    """
+    with ThreadPoolExecutor(max_workers=len(nodes)) as executor:
+        return list(executor.map(lambda node: make_session(*node), nodes))
+
+
+def shutdown_sessions(sessions: List[Session], concurrent: bool = True) -> None:
+    """
+    Shut down the clusters behind the given sessions, concurrently by default.
+
+    Also evicts their cached prepared statements and schema, so prefer this over calling
+    ``session.cluster.shutdown()`` directly.
+
+    :param sessions: Sessions whose clusters should be shut down.
+    :param concurrent: Shut down from a thread pool; pass False at interpreter
+        exit, when ``concurrent.futures`` no longer accepts new work.
+    """
+    clusters = {session.cluster for session in sessions}
+    for key in [key for key in list(_PREPARED) if key[0] in clusters]:
+        _PREPARED.pop(key, None)
+    with _ENSURED_LOCK:
+        _ENSURED.difference_update([key for key in _ENSURED if key[0] in clusters])
+    if not concurrent:
+        for session in sessions:
+            session.cluster.shutdown()
+        return
+    with ThreadPoolExecutor(max_workers=len(sessions)) as executor:
+        list(executor.map(lambda session: session.cluster.shutdown(), sessions))
+
+
+def connect_nodes(nodes: List[Tuple[str, int]]) -> List[PinnedSession]:
+    """
+    Return a (session, execution profile) pair pinned to each node.
+
+    Nodes with distinct hosts on a common port share one Cluster. Port-mapped
+    nodes (e.g. several containers behind localhost) each need their own
+    Cluster, since the driver only takes a single port per Cluster.
+
+    :param nodes: List of (host, port) contact points.
+    :return: Pinned sessions, in the same order as ``nodes``.
+    """
+    hosts = {h for h, _ in nodes}
+    ports = {p for _, p in nodes}
+    if len(hosts) == len(nodes) and len(ports) == 1:
+        session = make_shared_session(nodes)
+        return [(session, node_label(h, p)) for h, p in nodes]
+    return [(session, EXEC_PROFILE_DEFAULT) for session in make_sessions(nodes)]
+
+
+def distinct_sessions(pinned: List[PinnedSession]) -> List[Session]:
+    """
+    Return each underlying session of ``pinned`` once, in order.
+    """
+    return list(dict.fromkeys(session for session, _ in pinned))
+
+
+def shutdown_nodes(pinned: List[PinnedSession]) -> None:
+    """
+    Shut down every Cluster behind the pinned sessions exactly once.
+    """
+    shutdown_sessions(distinct_sessions(pinned))
@@ -2,21 +2,67 @@
 """
 Simple incremental logger that accepts a level parameter.
 """
-from typing import Literal
+import enum
+import itertools
+import os
+from typing import Any
 from colors import INFO, SUCCESS, FAIL, WARN, RESET, SEPARATOR
 
-LogLevel = Literal[INFO, SUCCESS, FAIL, WARN, SEPARATOR]
 
-# Internal counter
-_STEP = {"n": 0}
+class Level(enum.Enum):
+    """
+    Log levels; each is printed in its color from :data:`_COLORS`.
+    """
+    INFO = enum.auto()
+    SUCCESS = enum.auto()
+    FAIL = enum.auto()
+    WARN = enum.auto()
+    # Plain progress lines in the default terminal style
+    PLAIN = enum.auto()
+    SEPARATOR = enum.auto()
+
+
+# Level colors; looked up separately, since several levels may share a color
+# (or have none at all when colors are disabled)
+_COLORS = {
+    Level.INFO: INFO,
+    Level.SUCCESS: SUCCESS,
+    Level.FAIL: FAIL,
+    Level.WARN: WARN,
+    Level.PLAIN: RESET,
+    Level.SEPARATOR: SEPARATOR,
+}
+
+# Internal step counter; next() on itertools.count is atomic, so concurrent tests never share a number
+_STEP = itertools.count(1)
+
+# With LOG_QUIET set, progress chatter is dropped and only results, warnings and failures print
+_QUIET = bool(os.getenv("LOG_QUIET"))
+_QUIET_LEVELS = frozenset({Level.INFO, Level.PLAIN})
 
-def log(message: str, level: str = INFO, extra_newline: bool = False) -> None:
+
+def is_enabled(level: Level) -> bool:
+    """
+    Return whether messages at ``level`` are printed at all.
+    """
+    return not (_QUIET and level in _QUIET_LEVELS)
+
+
+def log(message: str, *args: Any, level: Level = Level.INFO, extra_newline: bool = False) -> None:
     """
     Print a numbered, colored log message.
 
-    :param message: The text to log (emojis OK, no colors embedded).
-    :param level:   Color/level constant (INFO, SUCCESS, FAIL, WARN).
+    Like :mod:`logging`, ``message`` is only %-formatted with ``args`` once the
+    level is known to be enabled, so discarded messages cost no formatting.
+
+    :param message: The text to log, or a %-format string for ``args`` (emojis OK).
+    :param args:    Values substituted into ``message``.
+    :param level:   Log level, which also picks the line's color.
     """
-    _STEP["n"] += 1
+    if not is_enabled(level):
+        return
+    if args:
+        message = message % args
     newline = "\n" if extra_newline is True else ""
-    print(f"{newline}{level}[{_STEP['n']:02}] {message}{RESET}", flush=True)
+    step = next(_STEP)
+    print(f"{newline}{_COLORS[level]}[{step:02}] {message}{RESET}")
@@ -0,0 +1,56 @@
+"""
+Process-wide pool of per-node sessions, shared across tests and shut down at exit.
+"""
+import atexit
+import threading
+from typing import Dict, Tuple
+
+from cassandra.cluster import Session
+from cassandra.policies import ExponentialReconnectionPolicy
+from cassandra_utils.driver import make_session, shutdown_sessions
+
+# (host, port) -> connected session
+_SESSIONS: Dict[Tuple[str, int], Session] = {}
+_LOCK = threading.Lock()
+
+
+def get_session(host: str, port: int) -> Session:
+    """
+    Return the pooled session pinned to ``host:port``, connecting on first use.
+
+    Pooled sessions are shared between tests, possibly running concurrently, so
+    callers must not change their keyspace or shut them down; use
+    keyspace-qualified table names instead.
+
+    :param host: Hostname or IP of the node.
+    :param port: Native transport port of the node.
+    :return: Connected Cassandra Session.
+    """
+    with _LOCK:
+        session = _SESSIONS.get((host, port))
+        if session is None:
+            # Tests pause nodes, so retry a lost node quickly rather than backing off for minutes
+            session = make_session(
+                host, port,
+                reconnection_policy=ExponentialReconnectionPolicy(base_delay=1, max_delay=32),
+            )
+            _SESSIONS[(host, port)] = session
+        return session
+
+
+def shutdown_pool() -> None:
+    """
+    Shut down every pooled session.
+
+    Called by ``main`` once the tests are done, and registered to run at
+    interpreter exit as a fallback; clusters are shut down one at a time, since
+    thread pools can no longer be started from atexit callbacks.
+    """
+    with _LOCK:
+        sessions = list(_SESSIONS.values())
+        _SESSIONS.clear()
+    if sessions:
+        shutdown_sessions(sessions, concurrent=False)
+
+
+atexit.register(shutdown_pool)
@@ -1,18 +1,39 @@
 # File: colors.py
 """
 Defines color constants for CLI output using colorama.
+
+Colors are disabled when ``NO_COLOR`` is set or stdout is not a terminal; the
+constants are then empty and colorama is never imported.
 """
-from colorama import Fore, Style
+import os
+import sys
+
+
+ENABLED = not os.getenv("NO_COLOR") and sys.stdout.isatty()
 
-# Success messages (green)
-SUCCESS = Fore.GREEN + Style.BRIGHT
-# Failure messages (red)
-FAIL = Fore.RED + Style.BRIGHT
-# Informational highlights (cyan)
-INFO = Fore.CYAN + Style.BRIGHT
-# Warnings/divider lines (yellow)
-WARN = Fore.YELLOW + Style.BRIGHT
-# Reset to default terminal style
-RESET = Style.RESET_ALL
+if ENABLED:
+    from colorama import Fore, Style
+
+    # Success messages (green)
+    SUCCESS = Fore.GREEN + Style.BRIGHT
+    # Failure messages (red)
+    FAIL = Fore.RED + Style.BRIGHT
+    # Informational highlights (cyan)
+    INFO = Fore.CYAN + Style.BRIGHT
+    # Warnings/divider lines (yellow)
+    WARN = Fore.YELLOW + Style.BRIGHT
+    # Reset to default terminal style
+    RESET = Style.RESET_ALL
+else:
+    SUCCESS = FAIL = INFO = WARN = RESET = ""
 # Seperator style
-SEPARATOR = Style.RESET_ALL
+SEPARATOR = RESET
+
+
+def init_colors() -> None:
+    """
+    Set up colorama on stdout when colors are enabled.
+    """
+    if ENABLED:
+        from colorama import init as colorama_init
+        colorama_init(autoreset=True)
@@ -1,83 +1,159 @@
+import argparse
+import importlib
+import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Set, Tuple
 
-from colorama import init as colorama_init
-from colors import SUCCESS, FAIL, INFO, SEPARATOR
+from colors import init_colors
 from cassandra_utils.discovery import discover_nodes
-from cassandra_utils.logger import log
-from tests.sql_test import sql_test
-from tests.nosql_test import nosql_test
-from tests.disconnect_reconnect_test import disconnect_reconnect_test
-from tests.network_limit_test import network_limit_test
+from cassandra_utils.driver import connect_nodes, shutdown_nodes
+from cassandra_utils.pool import shutdown_pool
+from cassandra_utils.logger import Level, log
 
 
-# Initialize colorama
-colorama_init(autoreset=True)
+# Flush stdout on every newline so log() does not need to flush per call;
+# done before colorama wraps the stream
+sys.stdout.reconfigure(line_buffering=True)
 
+# Initialize colorama (a no-op when colors are disabled)
+init_colors()
 
-def main() -> None:
-    # Discover Cassandra nodes
-    nodes = discover_nodes()
-    if len(nodes) < 2:
-        log(FAIL + "❌ Need at least two Cassandra nodes running")
-        sys.exit(1)
 
-    log(f"[MAIN] Nodes under test: {', '.join(f'{h}:{p}' for h, p in nodes)}", INFO)
+# A test entry: (name, label, module, function, keyword arguments).
+# Modules are imported lazily, so skipped tests never pay their import cost.
+TestEntry = Tuple[str, str, str, str, Dict[str, Any]]
 
-    # --- SQL Replication Test ---
-    log("-" * 80, SEPARATOR, True)
-    log("🛠️  [MAIN] Starting SQL Replication Test", INFO)
-    sql_ok = sql_test(nodes)
-    log(
-        f"{'✅' if sql_ok else '❌'}  [MAIN] SQL Test {'PASSED 🎉' if sql_ok else 'FAILED ❌'}",
-        SUCCESS if sql_ok else FAIL,
-    )
+# Called with (pinned sessions, nodes); they use disjoint keyspaces and all run side by side
+REPLICATION_TESTS: List[TestEntry] = [
+    ("sql", "SQL Test", "tests.sql_test", "sql_test", {}),
+    ("nosql", "NoSQL Test", "tests.nosql_test", "nosql_test", {}),
+]
 
-    # --- NoSQL Replication Test ---
-    log("-" * 80, SEPARATOR, True)
-    log(INFO + "🔧  [MAIN] Starting NoSQL Replication Test")
-    nosql_ok = nosql_test(nodes)
-    log(
-        f"{'✅' if nosql_ok else '❌'}  [MAIN] NoSQL Test {'PASSED 🎉' if nosql_ok else 'FAILED ❌'}",
-        SUCCESS if nosql_ok else FAIL,
-    )
+# Called with (nodes, **kwargs), one after another.
+# The network-limit entry runs all of its tc profiles over one keyspace and session.
+DISRUPTION_TESTS: List[TestEntry] = [
+    (
+        "disconnect", "Disconnect/Reconnect Test",
+        "tests.disconnect_reconnect_test", "disconnect_reconnect_test", {},
+    ),
+    (
+        "netlimit", "Network-Limit Test",
+        "tests.network_limit_test", "network_limit_test",
+        {"profiles": [
+            {"rate": "100kbit", "burst": "32kbit", "latency": "50ms", "rows": 500},
+            {"rate": "10kbit", "burst": "3kbit", "latency": "100ms", "rows": 500},
+        ]},
+    ),
+]
 
-    # --- Disconnect/Reconnect Test ---
-    log("-" * 80, SEPARATOR, True)
-    log(INFO + "🔌  [MAIN] Starting Disconnect/Reconnect Test")
-    disconnect_ok = disconnect_reconnect_test(nodes)
-    log(
-        f"{'✅' if disconnect_ok else '❌'}  [MAIN] Disconnect/Reconnect Test {'PASSED 🎉' if disconnect_ok else 'FAILED ❌'}",
-        SUCCESS if disconnect_ok else FAIL,
-    )
 
-    # --- Network-Limit Tests ---
-    log("-" * 80, SEPARATOR, True)
-    log(INFO + "🌐  [MAIN] Starting Network-Limit Test #1")
-    network_ok = network_limit_test(
-        nodes, rate="100kbit", burst="32kbit", latency="50ms", rows=500
-    )
-    log(
-        f"{'✅' if network_ok else '❌'}  [MAIN] Network-Limit Test {'PASSED 🎉' if network_ok else 'FAILED ❌'}",
-        SUCCESS if network_ok else FAIL,
-    )
+def _load(module: str, function: str) -> Callable[..., bool]:
+    """
+    Import and return a test function by module and attribute name.
+    """
+    return getattr(importlib.import_module(module), function)
 
-    log("-" * 80, SEPARATOR, True)
-    log(INFO + "🌐  [MAIN] Starting Network-Limit Test #1")
-    network_ok = network_limit_test(
-        nodes, rate="10kbit", burst="3kbit", latency="100ms", rows=500
-    )
-    log(
-        f"{'✅' if network_ok else '❌'}  [MAIN] Network-Limit Test {'PASSED 🎉' if network_ok else 'FAILED ❌'}",
-        SUCCESS if network_ok else FAIL,
+
+def _skipped_tests(argv: List[str]) -> Set[str]:
+    """
+    Collect test names to skip from ``--skip`` and ``SKIP_<NAME>`` environment variables.
+    """
+    parser = argparse.ArgumentParser(description="Cassandra replication test suite")
+    parser.add_argument(
+        "--skip", action="append", default=[], metavar="NAMES",
+        help="comma-separated test names to skip (repeatable)",
     )
+    args = parser.parse_args(argv)
+    skipped = {name.strip() for arg in args.skip for name in arg.split(",") if name.strip()}
+    for name, *_ in REPLICATION_TESTS + DISRUPTION_TESTS:
+        if os.getenv(f"SKIP_{name.upper()}"):
+            skipped.add(name)
+    return skipped
+
+
+def _log_result(label: str, ok: bool) -> None:
+    if ok:
+        log("✅  [MAIN] %s PASSED 🎉", label, level=Level.SUCCESS)
+    else:
+        log("❌  [MAIN] %s FAILED ❌", label, level=Level.FAIL)
+
+
+def _run_replication_tests(
+    nodes: List[Tuple[str, int]], entries: List[TestEntry]
+) -> Dict[str, bool]:
+    """
+    Run the replication tests concurrently over one shared set of node sessions.
+    """
+    log("Creating sessions…", level=Level.PLAIN)
+    pinned = connect_nodes(nodes)
+    try:
+        with ThreadPoolExecutor(max_workers=len(entries)) as executor:
+            futures = {
+                label: executor.submit(_load(module, function), pinned, nodes, **kwargs)
+                for _, label, module, function, kwargs in entries
+            }
+            return {label: future.result() for label, future in futures.items()}
+    finally:
+        shutdown_nodes(pinned)
+
+
+def _run_disruption_tests(
+    nodes: List[Tuple[str, int]], entries: List[TestEntry]
+) -> Dict[str, bool]:
+    """
+    Run the disruption tests one after another.
+
+    They never overlap: every test keyspace replicates to all nodes, so a node
+    paused by one test would fail the other's writes, schema changes and TRUNCATE.
+    """
+    results: Dict[str, bool] = {}
+    for _, label, module, function, kwargs in entries:
+        log("🚀  [MAIN] Starting %s", label)
+        test = _load(module, function)
+        results[label] = test(nodes, **kwargs)
+    return results
+
+
+def main() -> None:
+    skipped = _skipped_tests(sys.argv[1:])
+
+    # Discover Cassandra nodes
+    nodes = discover_nodes()
+    if len(nodes) < 2:
+        log("❌ Need at least two Cassandra nodes running", level=Level.FAIL)
+        sys.exit(1)
+
+    log("[MAIN] Nodes under test: %s", ", ".join(f"{h}:{p}" for h, p in nodes))
+    if skipped:
+        log("[MAIN] Skipping: %s", ", ".join(sorted(skipped)))
+
+    results: Dict[str, bool] = {}
+    try:
+        for title, runner, entries in (
+            ("Replication Tests", _run_replication_tests, REPLICATION_TESTS),
+            ("Disruption Tests", _run_disruption_tests, DISRUPTION_TESTS),
+        ):
+            enabled = [entry for entry in entries if entry[0] not in skipped]
+            if not enabled:
+                continue
+            log("-" * 80, level=Level.SEPARATOR, extra_newline=True)
+            log("🛠️  [MAIN] Starting %s", title)
+            phase_results = runner(nodes, enabled)
+            for label, ok in phase_results.items():
+                _log_result(label, ok)
+            results.update(phase_results)
+    finally:
+        # Pooled sessions used by the disruption tests
+        shutdown_pool()
 
     # --- Summary ---
-    log("-" * 80, SEPARATOR, True)
-    if all([sql_ok, nosql_ok, disconnect_ok, network_ok]):
-        log("🥳  [MAIN] ALL REPLICATION TESTS PASSED 🎉", SUCCESS)
+    log("-" * 80, level=Level.SEPARATOR, extra_newline=True)
+    if all(results.values()):
+        log("🥳  [MAIN] ALL REPLICATION TESTS PASSED 🎉", level=Level.SUCCESS)
         sys.exit(0)
 
-    log("😞  [MAIN] ONE OR MORE TESTS FAILED ❌", FAIL)
+    log("😞  [MAIN] ONE OR MORE TESTS FAILED ❌", level=Level.FAIL)
     sys.exit(1)
 
 
@@ -0,0 +1,91 @@
+# File: parallel.py
+"""
+Run a replication test against several separate clusters in worker processes.
+
+Each node list passed to :func:`run_all` must be a whole cluster of its own.
+Slices of one cluster do not work: the tests use fixed keyspaces with
+RF=len(nodes) and SimpleStrategy places replicas anywhere on the ring, so
+workers would share keyspaces and read replicas outside their slice.
+
+Call :func:`run_all` from a script under an ``if __name__ == "__main__":``
+guard, since workers may be spawned by re-importing the caller::
+
+    from parallel import run_all
+
+    if __name__ == "__main__":
+        clusters = [
+            [("10.0.1.1", 9042), ("10.0.1.2", 9042), ("10.0.1.3", 9042)],
+            [("10.0.2.1", 9042), ("10.0.2.2", 9042), ("10.0.2.3", 9042)],
+        ]
+        print(run_all(clusters))
+"""
+import importlib
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from multiprocessing.util import Finalize
+from typing import Dict, List, Optional, Tuple
+
+from cassandra_utils.driver import (
+    PinnedSession, connect_nodes, distinct_sessions, shutdown_sessions,
+)
+
+# Per-worker sessions, keyed by node list, so repeated runs over the same
+# contact points reuse their Clusters instead of reconnecting
+_PINNED: Dict[Tuple[Tuple[str, int], ...], List[PinnedSession]] = {}
+
+
+def _shutdown_worker() -> None:
+    """
+    Shut down every Cluster cached by this worker.
+    """
+    sessions = [session for pinned in _PINNED.values() for session in distinct_sessions(pinned)]
+    _PINNED.clear()
+    if sessions:
+        shutdown_sessions(sessions, concurrent=False)
+
+
+def _init_worker() -> None:
+    """
+    Reset per-process state in a fresh worker.
+
+    Forked workers inherit module globals, so start from an empty session
+    cache; random generators, the global one included, reseed themselves after
+    a fork. Clusters are only ever built inside workers, since driver
+    connections do not survive a fork.
+    """
+    _PINNED.clear()
+    # Worker processes skip atexit hooks, but run multiprocessing finalizers on exit
+    Finalize(None, _shutdown_worker, exitpriority=10)
+
+
+def _run(module: str, function: str, nodes: List[Tuple[str, int]]) -> bool:
+    """
+    Run one replication test over ``nodes`` with this worker's cached sessions.
+    """
+    key = tuple(nodes)
+    pinned = _PINNED.get(key)
+    if pinned is None:
+        pinned = _PINNED[key] = connect_nodes(list(key))
+    test = getattr(importlib.import_module(module), function)
+    return test(pinned, list(key))
+
+
+def run_all(
+    clusters: List[List[Tuple[str, int]]],
+    module: str = "tests.sql_test",
+    function: str = "sql_test",
+    max_workers: Optional[int] = None,
+) -> List[bool]:
+    """
+    Run a replication test on each cluster in parallel worker processes.
+
+    :param clusters: (host, port) pairs of each separate cluster, one test run per cluster.
+    :param module: Module holding the test, imported inside the workers.
+    :param function: Test function, called as ``function(pinned, nodes)``.
+    :param max_workers: Worker process count; one per cluster when omitted.
+    :return: Test results, in the same order as ``clusters``.
+    """
+    with ProcessPoolExecutor(
+        max_workers=max_workers or len(clusters), initializer=_init_worker
+    ) as executor:
+        return list(executor.map(partial(_run, module, function), clusters))
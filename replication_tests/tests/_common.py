@@ -0,0 +1,67 @@
+# File: tests/_common.py
+"""
+Replica verification and driver error groups shared by the tests.
+"""
+import uuid
+from typing import Any, List, Tuple
+
+from cassandra import ReadTimeout, Unavailable, WriteFailure, WriteTimeout
+from cassandra.cluster import NoHostAvailable, OperationTimedOut
+from cassandra_utils.driver import PinnedSession, prepare
+from cassandra_utils.logger import Level, log
+from colors import INFO, RESET
+
+# Client-side deadline for each write and read, so one slow node cannot stall a test
+# for the driver's 10s default. Kept clear of the server's 2s write and 5s read
+# timeouts, so either side's timeout is reported rather than a race between them.
+FAST_TIMEOUT = 3.0
+
+# Errors that fail a write or a replica read rather than escaping the test
+WRITE_ERRORS = (OperationTimedOut, WriteTimeout, WriteFailure, Unavailable, NoHostAvailable)
+READ_ERRORS = (OperationTimedOut, ReadTimeout, Unavailable, NoHostAvailable)
+
+# Log formats, built once; log() only fills them in when the level is enabled
+_MISMATCH_MSG = f"Mismatch on {INFO}%s:%s{RESET} for id={INFO}%s{RESET}"
+_OK_MSG = f"OK on {INFO}%s:%s{RESET}"
+_READ_ERROR_MSG = f"Reading from {INFO}%s:%s{RESET} failed: {INFO}%s{RESET}"
+
+
+def verify_replicas(
+    readers: List[PinnedSession],
+    nodes: List[Tuple[str, int]],
+    select_cql: str,
+    row_id: uuid.UUID,
+    expected: Any,
+) -> bool:
+    """
+    Read ``row_id`` back from every reader and check it matches ``expected``.
+
+    :param readers: Sessions pinned to the nodes to verify.
+    :param nodes: Host/port pairs matching ``readers``.
+    :param select_cql: Single-column ``SELECT`` keyed by id.
+    :param row_id: Id of the row to read.
+    :param expected: Value the selected column should hold on every node.
+    """
+    success = True
+    # Fan the reads out to every replica before waiting on any of them
+    futures = []
+    for (host, port), (session, profile) in zip(nodes, readers):
+        select_stmt = prepare(session, select_cql)
+        future = session.execute_async(
+            select_stmt, (row_id,), timeout=FAST_TIMEOUT, execution_profile=profile
+        )
+        futures.append((host, port, future))
+    for host, port, future in futures:
+        try:
+            row = future.result().one()
+        except READ_ERRORS as err:
+            log(_READ_ERROR_MSG, host, port, err, level=Level.FAIL)
+            success = False
+            continue
+        if not row or row[0] != expected:
+            log(_MISMATCH_MSG, host, port, row_id, level=Level.FAIL)
+            success = False
+        else:
+            log(_OK_MSG, host, port, level=Level.SUCCESS)
+
+    return success
@@ -2,139 +2,203 @@
 """
 Simulate a node disconnect/reconnect and verify replication consistency.
 """
-import json
 import random
 import subprocess
+import threading
 import time
 import uuid
-from typing import List, Optional, Tuple
+from typing import Any, List, Optional, Tuple
 
-from cassandra.cluster import OperationTimedOut
-from cassandra_utils.driver import make_session
-from cassandra_utils.logger import log
-from colors import INFO, SUCCESS, FAIL, WARN, RESET
+from cassandra import InvalidRequest
+from cassandra.cluster import NoHostAvailable, OperationTimedOut, Session
+from cassandra.policies import HostStateListener
+from cassandra.pool import Host
+from cassandra.query import SimpleStatement
+from cassandra_utils.containers import get_container_id_for_port
+from cassandra_utils.driver import create_keyspace_statement, ensure_schema, prepare
+from cassandra_utils.pool import get_session
+from cassandra_utils.logger import Level, log
+from colors import INFO, RESET
 
+# Generous client-side deadlines for a cluster with a paused node; server-side
+# timeouts and unavailability are left to the driver's retry policy
+_DDL_TIMEOUT = 30.0
+_WRITE_TIMEOUT = 20.0
+# How long to wait for a backgrounded podman pause/unpause to finish
+_PODMAN_TIMEOUT = 5.0
 
-def _get_container_id_for_port(port: int) -> Optional[str]:
+KEYSPACE = "disconnect_test"
+_CREATE_TABLE = SimpleStatement(
+    f"CREATE TABLE IF NOT EXISTS {KEYSPACE}.kv (id uuid PRIMARY KEY, value text)",
+    is_idempotent=True,
+)
+_INSERT_CQL = f"INSERT INTO {KEYSPACE}.kv (id, value) VALUES (?, ?)"
+_SELECT_CQL = f"SELECT value FROM {KEYSPACE}.kv WHERE id=?"
+
+
+class _HostUpListener(HostStateListener):
+    """
+    Set an event whenever the driver sees a host come back up.
     """
-    Return the Podman container ID exposing the given host port, or None if not found.
+    def __init__(self, event: threading.Event) -> None:
+        self.event = event
+
+    def on_up(self, host: Host) -> None:
+        self.event.set()
+
+    def on_down(self, host: Host) -> None:
+        pass
+
+    def on_add(self, host: Host) -> None:
+        pass
+
+    def on_remove(self, host: Host) -> None:
+        pass
+
+
+def _finish_podman(proc: "subprocess.Popen[bytes]") -> int:
+    """
+    Wait for a backgrounded podman command, killing it if it overruns.
+
+    :return: Its exit status; negative if it had to be killed.
     """
     try:
-        output = subprocess.check_output(
-            ["podman", "ps", "--format", "json"], text=True, stderr=subprocess.DEVNULL
-        )
-        containers = json.loads(output)
-    except subprocess.CalledProcessError:
-        return None
-    for cont in containers:
-        for p in cont.get("Ports", []):
-            if p.get("host_port") == port and p.get("protocol") == "tcp":
-                return cont.get("Id")
-    return None
+        return proc.wait(timeout=_PODMAN_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        return proc.wait()
+
+
+def _wait_podman(proc: "subprocess.Popen[bytes]") -> None:
+    """
+    Wait for a backgrounded podman command and fail like ``check=True`` would.
+
+    :raises subprocess.CalledProcessError: If podman exited non-zero or timed out.
+    """
+    if _finish_podman(proc):
+        raise subprocess.CalledProcessError(proc.returncode, proc.args)
+
+
+def _read_after_resume(
+    session: Session, select_cql: str, row_id: uuid.UUID, expected: str, timeout: float = 15.0
+) -> Optional[Any]:
+    """
+    Poll the resumed node until it returns the expected value, or ``timeout`` elapses.
+
+    While the driver still considers the node down, wait for its host-up event
+    instead of sleeping blind. The node was paused while the schema was created,
+    so "unconfigured table" errors are retried until it has caught up. Returns
+    the last row read (None if none was).
+    """
+    host_up = threading.Event()
+    listener = _HostUpListener(host_up)
+    session.cluster.register_listener(listener)
+    deadline = time.time() + timeout
+    row = None
+    try:
+        while time.time() < deadline:
+            try:
+                row = session.execute(prepare(session, select_cql), (row_id,)).one()
+            except NoHostAvailable:
+                host_up.wait(max(0.0, deadline - time.time()))
+                host_up.clear()
+                continue
+            except OperationTimedOut:
+                log("Timeout querying resumed node; retrying...", level=Level.WARN)
+                continue
+            except InvalidRequest:
+                # Schema not propagated to the resumed node yet
+                time.sleep(0.1)
+                continue
+            if row and row.value == expected:
+                break
+            time.sleep(0.1)
+    finally:
+        session.cluster.unregister_listener(listener)
+    return row
 
 
 def disconnect_reconnect_test(nodes: List[Tuple[str, int]]) -> bool:
     """
-    Pause a random Cassandra node, write data elsewhere, then unpause and verify replication.
+    Pause a Cassandra node, write data elsewhere, then unpause and verify replication.
+
+    :param nodes: Host/port pairs of the cluster.
     """
     idx = random.randrange(len(nodes))
     host_to_pause, port_to_pause = nodes[idx]
-    log(f"Selected node for pause: {INFO}{host_to_pause}:{port_to_pause}{RESET}", RESET)
+    log(f"Selected node for pause: {INFO}%s:%s{RESET}", host_to_pause, port_to_pause, level=Level.PLAIN)
 
-    container_id = _get_container_id_for_port(port_to_pause)
+    container_id = get_container_id_for_port(port_to_pause)
     if not container_id:
-        log(f"Could not find container for port {INFO}{port_to_pause}{RESET}", FAIL)
+        log(f"Could not find container for port {INFO}%s{RESET}", port_to_pause, level=Level.FAIL)
         return False
-    log(f"Pausing container {INFO}{container_id}{RESET}", RESET)
-    subprocess.run(["podman", "pause", container_id], check=True)
-
-    writer_host, writer_port = random.choice(
-        [n for n in nodes if n[1] != port_to_pause]
+    log(f"Pausing container {INFO}%s{RESET}", container_id, level=Level.PLAIN)
+    # Let podman pause while the writer session connects; the finally below reaps it
+    pause_proc = subprocess.Popen(  # pylint: disable=consider-using-with
+        ["podman", "pause", container_id]
     )
-    log(f"Writer node: {INFO}{writer_host}:{writer_port}{RESET}", RESET)
-    writer_session = make_session(writer_host, writer_port)
-
-    keyspace = "disconnect_test"
+    unpause_proc = None
     try:
-        writer_session.execute(
-            f"""
-            CREATE KEYSPACE IF NOT EXISTS {keyspace}
-            WITH replication = {{'class':'SimpleStrategy','replication_factor':{len(nodes)}}}
-        """
-        )
-    except OperationTimedOut:
-        log("Timeout creating keyspace; retrying once...", WARN)
+        # Any node but the paused one, picked without building a filtered list
+        writer_idx = (idx + 1 + random.randrange(len(nodes) - 1)) % len(nodes)
+        writer_host, writer_port = nodes[writer_idx]
+        log(f"Writer node: {INFO}%s:%s{RESET}", writer_host, writer_port, level=Level.PLAIN)
+        writer_session = get_session(writer_host, writer_port)
+        _wait_podman(pause_proc)
+
         try:
-            writer_session.execute(
-                f"""
-                CREATE KEYSPACE IF NOT EXISTS {keyspace}
-                WITH replication = {{'class':'SimpleStrategy','replication_factor':{len(nodes)}}}
-            """
+            ensure_schema(
+                writer_session, KEYSPACE,
+                [create_keyspace_statement(KEYSPACE, len(nodes)), _CREATE_TABLE],
+                timeout=_DDL_TIMEOUT,
             )
         except OperationTimedOut:
-            log("Failed to create keyspace after retry", FAIL)
-            writer_session.cluster.shutdown()
+            log("Timeout creating schema", level=Level.FAIL)
             return False
 
-    writer_session.set_keyspace(keyspace)
-
-    create_table_cql = "CREATE TABLE IF NOT EXISTS kv (id uuid PRIMARY KEY, value text)"
-    for attempt in range(2):
+        test_id = uuid.uuid4()
+        test_value = "reconnect_" + str(random.randint(1000, 9999))
+        log(
+            f"Writing id={INFO}%s{RESET} value={INFO}%s{RESET} on {INFO}%s:%s{RESET}",
+            test_id, test_value, writer_host, writer_port, level=Level.PLAIN,
+        )
+        # Marked idempotent per call, so the driver may retry it; the cached prepared
+        # statement is shared and left untouched
+        insert = prepare(writer_session, _INSERT_CQL).bind((test_id, test_value))
+        insert.is_idempotent = True
         try:
-            writer_session.execute(create_table_cql)
-            break
+            writer_session.execute(insert, timeout=_WRITE_TIMEOUT)
         except OperationTimedOut:
-            log(f"Timeout creating table (attempt {attempt+1}); retrying...", WARN)
-            time.sleep(1)
-    else:
-        log("Failed to create table after retries", FAIL)
-        writer_session.cluster.shutdown()
-        return False
+            log("Timeout inserting row", level=Level.FAIL)
+            return False
 
-    test_id = uuid.uuid4()
-    test_value = "reconnect_" + str(random.randint(1000, 9999))
-    log(
-        f"Writing id={INFO}{test_id}{RESET} value={INFO}{test_value}{RESET} "
-        f"on {INFO}{writer_host}:{writer_port}{RESET}",
-        RESET,
-    )
-    prepared = writer_session.prepare("INSERT INTO kv (id, value) VALUES (?, ?)")
-    for attempt in range(2):
-        try:
-            writer_session.execute(prepared, (test_id, test_value))
-            break
-        except OperationTimedOut:
-            log(f"Timeout inserting row (attempt {attempt+1}); retrying...", WARN)
-            time.sleep(1)
-    else:
-        log("Failed to insert row after retries", FAIL)
-        writer_session.cluster.shutdown()
+        log(f"Unpausing container {INFO}%s{RESET}", container_id, level=Level.PLAIN)
+        unpause_proc = subprocess.Popen(  # pylint: disable=consider-using-with
+            ["podman", "unpause", container_id]
+        )
+        resumed_session = get_session(host_to_pause, port_to_pause)
+        _wait_podman(unpause_proc)
+    except subprocess.CalledProcessError as exc:
+        log("%s", exc, level=Level.FAIL)
         return False
+    finally:
+        # Never leave the node paused for later tests, whichever way we got here;
+        # podman commands still running are ended first, so the unpause cannot race them
+        _finish_podman(pause_proc)
+        if unpause_proc is None or _finish_podman(unpause_proc):
+            log(f"Unpausing container {INFO}%s{RESET}", container_id, level=Level.PLAIN)
+            subprocess.run(["podman", "unpause", container_id], check=False)
 
-    log(f"Unpausing container {INFO}{container_id}{RESET}", RESET)
-    subprocess.run(["podman", "unpause", container_id], check=True)
-    time.sleep(10)
-
-    resumed_session = make_session(host_to_pause, port_to_pause)
-    resumed_session.set_keyspace(keyspace)
-    select_stmt = resumed_session.prepare("SELECT value FROM kv WHERE id=?")
-    try:
-        row = resumed_session.execute(select_stmt, (test_id,)).one()
-    except OperationTimedOut:
-        log("Timeout querying resumed node", FAIL)
-        row = None
-
-    writer_session.cluster.shutdown()
-    resumed_session.cluster.shutdown()
+    row = _read_after_resume(resumed_session, _SELECT_CQL, test_id, test_value)
 
     if not row or row.value != test_value:
         log(
-            f"Mismatch after reconnect on {INFO}{host_to_pause}:{port_to_pause}{RESET}",
-            FAIL,
+            f"Mismatch after reconnect on {INFO}%s:%s{RESET} for id={INFO}%s{RESET}",
+            host_to_pause, port_to_pause, test_id, level=Level.FAIL,
         )
         return False
     log(
-        f"Reconnect test passed on {INFO}{host_to_pause}:{port_to_pause}{RESET}",
-        SUCCESS,
+        f"Reconnect test passed on {INFO}%s:%s{RESET}", host_to_pause, port_to_pause,
+        level=Level.SUCCESS,
     )
     return True
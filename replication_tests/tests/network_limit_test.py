@@ -2,137 +2,278 @@
 """
 Simulate limited network throughput between Cassandra nodes and measure replication speed.
 """
-import json
 import random
+import re
+import secrets
 import subprocess
-import string
+import threading
 import time
 import uuid
-from typing import List, Optional, Tuple
+from collections import deque
+from typing import Any, Deque, Dict, List, NamedTuple, Tuple
 
-from cassandra_utils.driver import make_session
-from cassandra_utils.logger import log
-from colors import INFO, SUCCESS, FAIL, WARN, RESET
+from cassandra import ConsistencyLevel
+from cassandra.cluster import NoHostAvailable, OperationTimedOut, ResponseFuture, Session
+from cassandra.query import BatchStatement, BatchType, PreparedStatement
+from cassandra_utils.containers import ContainerShell, get_container_id_for_port
+from cassandra_utils.driver import create_keyspace_statement, prepare
+from cassandra_utils.pool import get_session
+from cassandra_utils.logger import Level, log
+from colors import INFO, RESET
+from tests._common import WRITE_ERRORS
 
+# Unlogged batch bounds: Cassandra rejects batches above 50 KiB by default
+# (batch_size_fail_threshold), and 100 statements is the usual practical cap
+_BATCH_MAX_BYTES = 40 * 1024
+_BATCH_MAX_ROWS = 100
+# Maximum number of insert batches awaiting a response at once
+_MAX_IN_FLIGHT = 32
+# Slack on top of the time the throttled rate alone would need to carry every row
+_DEADLINE_SLACK = 10.0
 
-def _get_container_id_for_port(port: int) -> Optional[str]:
+# tc rate units, in bits per second
+_RATE_UNITS = {"bit": 1, "kbit": 1000, "mbit": 1000 ** 2, "gbit": 1000 ** 3}
+_RATE_RE = re.compile(r"(\d+(?:\.\d+)?)([kmg]?bit)")
+
+KEYSPACE = "network_limit_test"
+_INSERT_CQL = f"INSERT INTO {KEYSPACE}.kv (id, value) VALUES (?, ?)"
+# Count primary keys up to the expected total instead of a full count(*) scan
+_PROBE_CQL = f"SELECT id FROM {KEYSPACE}.kv LIMIT ?"
+
+
+class _Lane(NamedTuple):
     """
-    Return the Podman container ID exposing the given host port, or None if not found.
+    Everything a profile run needs from the writer and the throttled node.
     """
-    try:
-        output = subprocess.check_output(
-            ["podman", "ps", "--format", "json"], text=True, stderr=subprocess.DEVNULL
-        )
-        containers = json.loads(output)
-    except subprocess.CalledProcessError:
-        return None
-    for cont in containers:
-        for p in cont.get("Ports", []):
-            if p.get("host_port") == port and p.get("protocol") == "tcp":
-                return cont.get("Id")
-    return None
-
-
-def network_limit_test(
-    nodes: List[Tuple[str, int]],
-    rate: str = "100kbit",
-    burst: str = "32kbit",
-    latency: str = "50ms",
-    rows: int = 10,
+    # Shell inside the throttled node's container
+    shell: ContainerShell
+    # Session of the writer node
+    writer: Session
+    # Session pinned to the throttled node
+    reader: Session
+    # Prepared INSERT into the test table, on the writer
+    insert_stmt: PreparedStatement
+    # Prepared LIMIT ? probe, on the reader
+    probe_stmt: PreparedStatement
+
+
+class _Profile(NamedTuple):
+    """
+    One tc token-bucket profile and the load to send through it.
+    """
+    rate: str
+    burst: str
+    latency: str
+    rows: int = 10
     value_size: int = 10000
+
+
+def _new_batch() -> BatchStatement:
+    """
+    Return an empty unlogged batch acknowledged by the first replica to apply it.
+
+    Waiting for ALL would tie every batch to the server's 2s write timeout: the
+    throttled node's TCP acks share its shaped egress, so large batches cannot
+    reach it that fast on slow profiles. Replication is timed by probing instead.
+    """
+    return BatchStatement(batch_type=BatchType.UNLOGGED, consistency_level=ConsistencyLevel.ONE)
+
+
+def _rate_bytes_per_s(rate: str) -> float:
+    """
+    Convert a tc rate such as ``100kbit`` to bytes per second.
+
+    :raises ValueError: If ``rate`` is not a bit rate tc understands.
+    """
+    match = _RATE_RE.fullmatch(rate.lower())
+    if not match:
+        raise ValueError(f"Unsupported tc rate: {rate!r}")
+    return float(match.group(1)) * _RATE_UNITS[match.group(2)] / 8
+
+
+def _wait_for_rows(
+    session: Session, probe_stmt: PreparedStatement, rows: int, timeout: float
 ) -> bool:
     """
-    Throttle egress on a random Cassandra node, insert rows, and measure replication time.
+    Re-issue ``probe_stmt`` asynchronously until it returns ``rows`` rows or ``timeout`` elapses.
+
+    Each response is handled on the driver's reactor thread; a short, growing
+    timer re-arms the probe, so the caller just blocks on an event. Failed probes
+    are retried silently and summed up in one warning once the wait is over.
     """
-    idx = random.randrange(len(nodes))
-    host_thr, port_thr = nodes[idx]
-    log(
-        f"Throttling node: {INFO}{host_thr}:{port_thr}{RESET} at "
-        f"{INFO}{rate}{RESET}, burst={INFO}{burst}{RESET}, latency={INFO}{latency}{RESET}",
-        RESET
-    )
+    replicated = threading.Event()
+    stopped = threading.Event()
+    errors: List[Exception] = []
 
-    container_id = _get_container_id_for_port(port_thr)
-    if not container_id:
-        log(f"Could not find container for port {INFO}{port_thr}{RESET}", FAIL)
-        return False
+    def issue(delay: float) -> None:
+        if stopped.is_set():
+            return
+        bound = probe_stmt.bind((rows,))
+        bound.fetch_size = rows  # the whole LIMIT fits in the first page
+        future = session.execute_async(bound)
+        future.add_callbacks(on_rows, on_error, callback_args=(delay,), errback_args=(delay,))
+
+    def retry(delay: float) -> None:
+        if not stopped.is_set():
+            timer = threading.Timer(delay, issue, (min(delay * 2, 1.0),))
+            timer.daemon = True
+            timer.start()
+
+    def on_rows(page: List[Any], delay: float) -> None:
+        if len(page) >= rows:
+            replicated.set()
+        else:
+            retry(delay)
+
+    def on_error(exc: Exception, delay: float) -> None:
+        errors.append(exc)
+        retry(delay)
+
+    issue(0.1)
+    done = replicated.wait(timeout)
+    stopped.set()
+    if errors:
+        log(
+            f"{INFO}%d{RESET} replication probes failed; last error: {INFO}%s{RESET}",
+            len(errors), errors[-1], level=Level.WARN,
+        )
+    return done
 
+
+def _insert_rows(lane: _Lane, rows: int, value_size: int) -> None:
+    """
+    Insert ``rows`` random values of ``value_size`` characters through the writer.
+
+    :raises WRITE_ERRORS: If a batch could not be written.
+    """
+    # Group rows into unlogged batches that stay under the server's batch size limit
+    rows_per_batch = max(1, min(_BATCH_MAX_ROWS, _BATCH_MAX_BYTES // value_size))
+    # token_urlsafe yields 4 characters per 3 random bytes
+    payload_bytes = value_size * 3 // 4 + 1
+
+    batch = _new_batch()
+    # Keep a bounded window of batches in flight so the driver can pipeline them
+    in_flight: Deque[ResponseFuture] = deque()
+    for n in range(1, rows + 1):
+        payload = secrets.token_urlsafe(payload_bytes)[:value_size]
+        batch.add(lane.insert_stmt, (uuid.uuid4(), payload))
+        if n % rows_per_batch == 0 or n == rows:
+            if len(in_flight) >= _MAX_IN_FLIGHT:
+                in_flight.popleft().result()
+            in_flight.append(lane.writer.execute_async(batch))
+            batch = _new_batch()
+    for future in in_flight:
+        future.result()
+
+
+def _run_profile(lane: _Lane, profile: _Profile) -> bool:
+    """
+    Apply one tc profile, insert rows, time their arrival on the throttled node, and
+    remove the profile again.
+
+    :param lane: Shell, sessions and statements shared by every profile.
+    :param profile: The tc settings and load for this run.
+    """
+    rate, burst, latency, rows, value_size = profile
+    log(
+        f"Applying profile rate={INFO}%s{RESET}, burst={INFO}%s{RESET}, latency={INFO}%s{RESET}",
+        rate, burst, latency, level=Level.PLAIN,
+    )
     try:
-        subprocess.run([
-            "podman", "exec", container_id,
-            "tc", "qdisc", "add", "dev", "eth0", "root", "tbf",
-            "rate", rate,
-            "burst", burst,
-            "latency", latency
-        ], check=True)
-        log("tc throttle applied successfully", RESET)
+        lane.shell.run(f"tc qdisc add dev eth0 root tbf rate {rate} burst {burst} latency {latency}")
+        log("tc throttle applied successfully", level=Level.PLAIN)
     except subprocess.CalledProcessError as err:
-        log(f"Failed to apply tc throttle: {INFO}{err}{RESET}", FAIL)
+        log(f"Failed to apply tc throttle: {INFO}%s{RESET}", err, level=Level.FAIL)
         return False
 
-    # Prepare writer session
-    writer_index = 0 if idx != 0 else 1
-    writer_host, writer_port = nodes[writer_index]
-    writer_session = make_session(writer_host, writer_port)
+    log(f"Inserting {INFO}%d{RESET} rows...", rows, level=Level.PLAIN)
+    # Timing starts with the first write, since replication overlaps the inserts
+    start_time = time.time()
+    success = True
+    try:
+        _insert_rows(lane, rows, value_size)
+        timeout = rows * value_size / _rate_bytes_per_s(rate) + _DEADLINE_SLACK
+        replicated = _wait_for_rows(lane.reader, lane.probe_stmt, rows, timeout)
+        duration = time.time() - start_time
+        if not replicated:
+            log(
+                f"Not all {INFO}%d{RESET} rows reached the throttled node within {INFO}%.2fs{RESET}",
+                rows, duration, level=Level.FAIL,
+            )
+            success = False
+        else:
+            throughput = rows / duration if duration > 0 else 0
+            log(
+                f"Replicated {INFO}%d{RESET} rows in {INFO}%.2fs{RESET} => {INFO}%.2f{RESET} rows/s",
+                rows, duration, throughput, level=Level.SUCCESS,
+            )
+    except WRITE_ERRORS as err:
+        log(f"Inserting rows failed: {INFO}%s{RESET}", err, level=Level.FAIL)
+        success = False
+    finally:
+        # Clean up throttle
+        try:
+            lane.shell.run("tc qdisc del dev eth0 root")
+            log("tc throttle removed", level=Level.PLAIN)
+        except subprocess.CalledProcessError as err:
+            log(f"Failed to remove tc qdisc: {INFO}%s{RESET}", err, level=Level.WARN)
+
+    return success
 
-    keyspace = "network_limit_test"
 
-    # Ensure keyspace exists
-    writer_session.execute(f"""
-        CREATE KEYSPACE IF NOT EXISTS {keyspace}
-        WITH replication = {{'class':'SimpleStrategy','replication_factor':{len(nodes)}}}
+def network_limit_test(nodes: List[Tuple[str, int]], profiles: List[Dict[str, Any]]) -> bool:
     """
-    )
-    writer_session.set_keyspace(keyspace)
-
-    # Drop and recreate table cleanly
-    writer_session.execute("DROP TABLE IF EXISTS kv")
-    writer_session.execute("CREATE TABLE kv (id uuid PRIMARY KEY, value text)")
-
-    log(f"Inserting {INFO}{rows}{RESET} rows into {INFO}{keyspace}.kv{RESET}...", RESET)
-    for _ in range(rows):
-        row_id = uuid.uuid4()
-        payload = "".join(random.choices(string.ascii_letters + string.digits, k=value_size))
-        writer_session.execute(
-            writer_session.prepare("INSERT INTO kv (id, value) VALUES (?, ?)") ,
-            (row_id, payload)
-        )
-    log(f"Inserted {INFO}{rows}{RESET} rows on {INFO}{writer_host}:{writer_port}{RESET}", RESET)
+    Throttle egress on a Cassandra node, insert rows, and measure replication time.
 
-    # Start timing replication on throttled node
-    start_time = time.time()
-    reader_session = make_session(host_thr, port_thr)
-    reader_session.set_keyspace(keyspace)
-
-    timeout = rows * value_size / (int(rate.rstrip("kbit")) * 128) + 10
-    elapsed = 0.0
-    while elapsed < timeout:
-        result = reader_session.execute("SELECT count(*) FROM kv").one()
-        count = result[0] if result else 0
-        if count >= rows:
-            break
-        time.sleep(1)
-        elapsed = time.time() - start_time
-
-    duration = time.time() - start_time
-    throughput = rows / duration if duration > 0 else 0
-    log(
-        f"Replicated {INFO}{rows}{RESET} rows in {INFO}{duration:.2f}s{RESET} => "
-        f"{INFO}{throughput:.2f}{RESET} rows/s",
-        SUCCESS
-    )
+    The keyspace, table and sessions are set up once and reused for every
+    profile; the table is truncated between profiles.
+
+    :param profiles: tc profiles to run in order, each a dict of ``rate``,
+        ``burst`` and ``latency``, plus optional ``rows`` and ``value_size``.
+    """
+    idx = random.randrange(len(nodes))
+    host_thr, port_thr = nodes[idx]
+    log(f"Throttling node: {INFO}%s:%s{RESET}", host_thr, port_thr, level=Level.PLAIN)
+
+    container_id = get_container_id_for_port(port_thr)
+    if not container_id:
+        log(f"Could not find container for port {INFO}%s{RESET}", port_thr, level=Level.FAIL)
+        return False
+
+    # Prepare writer session on any node but the throttled one
+    writer_idx = (idx + 1 + random.randrange(len(nodes) - 1)) % len(nodes)
+    writer_host, writer_port = nodes[writer_idx]
+    writer_session = get_session(writer_host, writer_port)
+    reader_session = get_session(host_thr, port_thr)
 
-    # Clean up throttle
     try:
-        subprocess.run([
-            "podman", "exec", container_id,
-            "tc", "qdisc", "del", "dev", "eth0", "root"
-        ], check=True)
-        log("tc throttle removed", RESET)
-    except subprocess.CalledProcessError as err:
-        log(f"Failed to remove tc qdisc: {INFO}{err}{RESET}", WARN)
+        writer_session.execute(create_keyspace_statement(KEYSPACE, len(nodes)))
+        # Drop and recreate table cleanly
+        writer_session.execute(f"DROP TABLE IF EXISTS {KEYSPACE}.kv")
+        writer_session.execute(f"CREATE TABLE {KEYSPACE}.kv (id uuid PRIMARY KEY, value text)")
+        insert_stmt = prepare(writer_session, _INSERT_CQL)
+        probe_stmt = prepare(reader_session, _PROBE_CQL)
+    except (OperationTimedOut, NoHostAvailable) as err:
+        log(f"Creating schema failed: {INFO}%s{RESET}", err, level=Level.FAIL)
+        return False
+
+    # One shell for every qdisc change, instead of a podman exec each
+    lane = _Lane(
+        ContainerShell(container_id), writer_session, reader_session, insert_stmt, probe_stmt
+    )
+    success = True
+    try:
+        for n, profile in enumerate(profiles):
+            if n:
+                # TRUNCATE needs every node up; without an empty table the next probe is meaningless
+                try:
+                    writer_session.execute(f"TRUNCATE {KEYSPACE}.kv")
+                except WRITE_ERRORS as err:
+                    log(f"Truncating between profiles failed: {INFO}%s{RESET}", err, level=Level.FAIL)
+                    success = False
+                    break
+            success = _run_profile(lane, _Profile(**profile)) and success
+    finally:
+        lane.shell.close()
 
-    # Shutdown sessions
-    writer_session.cluster.shutdown()
-    reader_session.cluster.shutdown()
-    return True
+    return success
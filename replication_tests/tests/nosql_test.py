@@ -2,57 +2,76 @@
 """
 Map-column based document replication tests using Cassandra.
 """
-import uuid
+import base64
+import os
 import random
-import time
-import string
+import uuid
 from typing import List, Tuple
 
-from cassandra_utils.driver import make_session
-from cassandra_utils.logger import log
-from colors import INFO, SUCCESS, FAIL, RESET
+from cassandra import ConsistencyLevel
+from cassandra.query import SimpleStatement
+from cassandra_utils.driver import (
+    PinnedSession, create_keyspace_statement, ensure_schema, prepare,
+)
+from cassandra_utils.logger import Level, log
+from colors import INFO, RESET
+from tests._common import FAST_TIMEOUT, WRITE_ERRORS, verify_replicas
+
+KEYSPACE = "nosql_test"
+_CREATE_TABLE = SimpleStatement(
+    f"CREATE TABLE IF NOT EXISTS {KEYSPACE}.documents (id uuid PRIMARY KEY, doc map<text,text>)",
+    is_idempotent=True,
+)
+_INSERT_CQL = f"INSERT INTO {KEYSPACE}.documents (id, doc) VALUES (?, ?)"
+_SELECT_CQL = f"SELECT doc FROM {KEYSPACE}.documents WHERE id=?"
+
+_USERS = ("alice", "bob", "carol", "dave")
+# Private generator, so document fields never draw from the shared global one.
+# Reseeded in forked children (as the random module does for its own), so
+# worker processes never repeat the parent's sequence.
+_RNG = random.Random()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_RNG.seed)
+
+# Log format, built once; log() only fills it in when the level is enabled
+_INSERT_MSG = f"INSERT doc id={INFO}%s{RESET} via {INFO}%s:%s{RESET}"
+
 
-def nosql_test(nodes: List[Tuple[str, int]]) -> bool:
+def nosql_test(pinned: List[PinnedSession], nodes: List[Tuple[str, int]]) -> bool:
     """
     Run a document (map<text,text>) insert/read test across multiple nodes.
+
+    Tables are keyspace-qualified rather than relying on ``set_keyspace``, since
+    the sessions in ``pinned`` are shared with tests running concurrently.
+
+    :param pinned: Sessions pinned to each node, as returned by ``connect_nodes``.
+    :param nodes: Host/port pairs matching ``pinned``.
     """
-    log("Creating sessions…", RESET)
-    sessions = [make_session(h, p) for h, p in nodes]
-    writer, readers = sessions[0], sessions[1:]
-
-    keyspace = "nosql_test"
-    writer.execute(f"""
-        CREATE KEYSPACE IF NOT EXISTS {keyspace}
-        WITH replication = {{'class':'SimpleStrategy','replication_factor':{len(nodes)}}}
-    """)
-    for session in sessions:
-        session.set_keyspace(keyspace)
-    writer.execute("CREATE TABLE IF NOT EXISTS documents (id uuid PRIMARY KEY, doc map<text,text>)")
+    (writer, writer_profile), readers = pinned[0], pinned[1:]
+
+    ensure_schema(
+        writer, KEYSPACE, [create_keyspace_statement(KEYSPACE, len(nodes)), _CREATE_TABLE],
+        execution_profile=writer_profile,
+    )
 
     # Generate test document
-    row_id = uuid.uuid4()
+    # One urandom call feeds both: 16 bytes of UUID, 6 bytes -> 8 base64 characters
+    raw = os.urandom(22)
+    row_id = uuid.UUID(bytes=raw[:16], version=4)
     doc = {
-        "user": random.choice(["alice", "bob", "carol", "dave"]),
-        "score": str(random.randint(0, 100)),
-        "token": "".join(random.choices(string.ascii_letters + string.digits, k=8)),
+        "user": _RNG.choice(_USERS),
+        "score": str(_RNG.randrange(101)),
+        "token": base64.urlsafe_b64encode(raw[16:]).decode(),
     }
-    log(
-        f"INSERT doc id={INFO}{row_id}{RESET} via {INFO}{nodes[0][0]}:{nodes[0][1]}{RESET}",
-        RESET
-    )
-    writer.execute(writer.prepare("INSERT INTO documents (id, doc) VALUES (?, ?)"), (row_id, doc))
-
-    time.sleep(2)
-    select_stmt = writer.prepare("SELECT doc FROM documents WHERE id=?")
-    success = True
-    for (host, port), session in zip(nodes[1:], readers):
-        row = session.execute(select_stmt, (row_id,)).one()
-        if not row or row.doc != doc:
-            log(f"Mismatch on {INFO}{host}:{port}{RESET}", FAIL)
-            success = False
-        else:
-            log(f"OK on {INFO}{host}:{port}{RESET}", SUCCESS)
-
-    for session in sessions:
-        session.cluster.shutdown()
-    return success
+    log(_INSERT_MSG, row_id, *nodes[0], level=Level.PLAIN)
+    # Writing at ALL only returns once every replica has the row, so no settle delay is needed
+    # CL is set on this bound statement only; the prepared one is cached and shared
+    insert = prepare(writer, _INSERT_CQL).bind((row_id, doc))
+    insert.consistency_level = ConsistencyLevel.ALL
+    try:
+        writer.execute(insert, timeout=FAST_TIMEOUT, execution_profile=writer_profile)
+    except WRITE_ERRORS as err:
+        log(f"Inserting row failed: {INFO}%s{RESET}", err, level=Level.FAIL)
+        return False
+
+    return verify_replicas(readers, nodes[1:], _SELECT_CQL, row_id, doc)
@@ -2,54 +2,63 @@
 """
 End-to-end SQL replication consistency tests using Cassandra.
 """
+import base64
+import os
 import uuid
-import random
-import string
-import time
 from typing import List, Tuple
 
-from cassandra_utils.driver import make_session
-from cassandra_utils.logger import log
-from colors import INFO, SUCCESS, FAIL, RESET
+from cassandra import ConsistencyLevel
+from cassandra.query import SimpleStatement
+from cassandra_utils.driver import (
+    PinnedSession, create_keyspace_statement, ensure_schema, prepare,
+)
+from cassandra_utils.logger import Level, log
+from colors import INFO, RESET
+from tests._common import FAST_TIMEOUT, WRITE_ERRORS, verify_replicas
 
-def sql_test(nodes: List[Tuple[str, int]]) -> bool:
+KEYSPACE = "replication_test"
+_CREATE_TABLE = SimpleStatement(
+    f"CREATE TABLE IF NOT EXISTS {KEYSPACE}.kv (id uuid PRIMARY KEY, value text)",
+    is_idempotent=True,
+)
+_INSERT_CQL = f"INSERT INTO {KEYSPACE}.kv (id, value) VALUES (?, ?)"
+_SELECT_CQL = f"SELECT value FROM {KEYSPACE}.kv WHERE id=?"
+
+# Log format, built once; log() only fills it in when the level is enabled
+_INSERT_MSG = f"INSERT id={INFO}%s{RESET} val='{INFO}%s{RESET}' via {INFO}%s:%s{RESET}"
+
+
+def sql_test(pinned: List[PinnedSession], nodes: List[Tuple[str, int]]) -> bool:
     """
     Run a simple key-value insert/read test across multiple Cassandra nodes.
+
+    Tables are keyspace-qualified rather than relying on ``set_keyspace``, since
+    the sessions in ``pinned`` are shared with tests running concurrently.
+
+    :param pinned: Sessions pinned to each node, as returned by ``connect_nodes``.
+    :param nodes: Host/port pairs matching ``pinned``.
     """
-    log("Creating sessions…", RESET)
-    sessions = [make_session(h, p) for h, p in nodes]
-    writer, readers = sessions[0], sessions[1:]
-
-    keyspace = "replication_test"
-    writer.execute(f"""
-        CREATE KEYSPACE IF NOT EXISTS {keyspace}
-        WITH replication = {{'class':'SimpleStrategy','replication_factor':{len(nodes)}}}
-    """)
-    for session in sessions:
-        session.set_keyspace(keyspace)
-    writer.execute("CREATE TABLE IF NOT EXISTS kv (id uuid PRIMARY KEY, value text)")
+    (writer, writer_profile), readers = pinned[0], pinned[1:]
 
-    # Prepare random test data
-    row_id = uuid.uuid4()
-    value = "".join(random.choices(string.ascii_letters + string.digits, k=12))
-    log(
-        f"INSERT id={INFO}{row_id}{RESET} val='{INFO}{value}{RESET}' via "
-        f"{INFO}{nodes[0][0]}:{nodes[0][1]}{RESET}",
-        RESET
+    ensure_schema(
+        writer, KEYSPACE, [create_keyspace_statement(KEYSPACE, len(nodes)), _CREATE_TABLE],
+        execution_profile=writer_profile,
     )
-    writer.execute(writer.prepare("INSERT INTO kv (id, value) VALUES (?, ?)"), (row_id, value))
-
-    time.sleep(2)
-    select_stmt = writer.prepare("SELECT value FROM kv WHERE id=?")
-    success = True
-    for (host, port), session in zip(nodes[1:], readers):
-        row = session.execute(select_stmt, (row_id,)).one()
-        if not row or row.value != value:
-            log(f"Mismatch on {INFO}{host}:{port}{RESET}", FAIL)
-            success = False
-        else:
-            log(f"OK on {INFO}{host}:{port}{RESET}", SUCCESS)
-
-    for session in sessions:
-        session.cluster.shutdown()
-    return success
+
+    # Prepare random test data
+    # One urandom call feeds both: 16 bytes of UUID, 9 bytes -> 12 base64 characters
+    raw = os.urandom(25)
+    row_id = uuid.UUID(bytes=raw[:16], version=4)
+    value = base64.urlsafe_b64encode(raw[16:]).decode()
+    log(_INSERT_MSG, row_id, value, *nodes[0], level=Level.PLAIN)
+    # Writing at ALL only returns once every replica has the row, so no settle delay is needed
+    # CL is set on this bound statement only; the prepared one is cached and shared
+    insert = prepare(writer, _INSERT_CQL).bind((row_id, value))
+    insert.consistency_level = ConsistencyLevel.ALL
+    try:
+        writer.execute(insert, timeout=FAST_TIMEOUT, execution_profile=writer_profile)
+    except WRITE_ERRORS as err:
+        log(f"Inserting row failed: {INFO}%s{RESET}", err, level=Level.FAIL)
+        return False
+
+    return verify_replicas(readers, nodes[1:], _SELECT_CQL, row_id, value)